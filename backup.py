@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+import gzip
+import importlib
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+from database import DB_FILE, get_sync_state, set_sync_state
+
+logger = logging.getLogger(__name__)
+
+# Configurazione (variabili d'ambiente)
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+# Backend di storage: vuoto = cartella locale, altrimenti "modulo:Classe" (costruita senza argomenti)
+BACKUP_STORAGE = os.getenv('BACKUP_STORAGE', '')
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', '3600'))  # secondi tra due snapshot
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '24'))            # snapshot conservati
+BACKUP_PAGES = int(os.getenv('BACKUP_PAGES', '64'))          # pagine copiate per passo
+BACKUP_SLEEP = 0.05                                          # pausa tra due passi (secondi)
+
+SNAPSHOT_PREFIX = "clan_data-"
+SNAPSHOT_SUFFIX = ".db.gz"
+# Chiave in sync_state: timestamp dell'ultimo snapshot preso da questo DB
+SNAPSHOT_KEY = "backup_snapshot_at"
+
+# Un solo snapshot alla volta (task periodico, snapshot finale, riga di comando)
+_snapshot_lock = threading.Lock()
+
+
+class LocalBackupStorage:
+    """
+    Storage degli snapshot su una cartella locale.
+    Per usare un altro backend (S3, disco remoto...) basta una classe con gli stessi
+    metodi (save, list, open, delete) indicata in BACKUP_STORAGE come "modulo:Classe".
+    """
+
+    def __init__(self, directory=BACKUP_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, name, src_path):
+        """Comprime src_path nello snapshot `name` (scrittura atomica)."""
+        final_path = os.path.join(self.directory, name)
+        tmp_path = final_path + ".tmp"
+        with open(src_path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, final_path)
+
+    def list(self):
+        """Nomi degli snapshot, dal più vecchio al più recente."""
+        return sorted(n for n in os.listdir(self.directory)
+                      if n.startswith(SNAPSHOT_PREFIX) and n.endswith(SNAPSHOT_SUFFIX))
+
+    def open(self, name):
+        """Ritorna un file in lettura con il DB già decompresso."""
+        return gzip.open(os.path.join(self.directory, name), "rb")
+
+    def delete(self, name):
+        os.remove(os.path.join(self.directory, name))
+
+
+def get_storage():
+    """Crea il backend configurato in BACKUP_STORAGE (default: LocalBackupStorage)."""
+    if not BACKUP_STORAGE:
+        return LocalBackupStorage()
+    module_name, class_name = BACKUP_STORAGE.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _snapshot_time(name):
+    return name[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)]
+
+
+# --- SNAPSHOT ---
+def take_snapshot(storage=None):
+    """
+    Copia il DB con l'API di backup incrementale di SQLite, a piccoli blocchi di
+    pagine: tra un passo e l'altro bot e dashboard possono continuare a scrivere.
+    Ritorna il nome dello snapshot creato.
+    """
+    storage = storage or get_storage()
+    with _snapshot_lock:
+        return _take_snapshot(storage)
+
+
+def _take_snapshot(storage):
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    name = f"{SNAPSHOT_PREFIX}{stamp}{SNAPSHOT_SUFFIX}"
+
+    src = sqlite3.connect(DB_FILE)
+    # Il timestamp finisce dentro lo snapshot: all'avvio capiamo se il DB locale è più vecchio
+    set_sync_state(src.cursor(), SNAPSHOT_KEY, stamp)
+    src.commit()
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        dst = sqlite3.connect(tmp_path)
+        with dst:
+            src.backup(dst, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP)
+        dst.close()
+        storage.save(name, tmp_path)
+    finally:
+        src.close()
+        os.remove(tmp_path)
+
+    rotate_snapshots(storage)
+    return name
+
+
+def rotate_snapshots(storage, keep=BACKUP_KEEP):
+    """Elimina gli snapshot più vecchi lasciandone `keep`."""
+    names = storage.list()
+    for name in names[:max(len(names) - keep, 0)]:
+        storage.delete(name)
+
+
+async def backup_loop(storage=None, interval=BACKUP_INTERVAL):
+    """Task periodico: uno snapshot ogni `interval` secondi, in un thread separato."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            name = await asyncio.to_thread(take_snapshot, storage)
+            logger.info("💾 Backup creato: %s", name)
+        except Exception as e:
+            logger.exception("Errore durante il backup: %s", e)
+
+
+# --- RESTORE ---
+def restore_snapshot(name, storage=None):
+    """Sostituisce DB_FILE con lo snapshot `name`. Da usare prima di aprire connessioni."""
+    storage = storage or get_storage()
+    tmp_path = DB_FILE + ".restore"
+    with storage.open(name) as src, open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+    # Verifica che lo snapshot sia un DB integro prima di sovrascrivere quello attuale
+    conn = sqlite3.connect(tmp_path)
+    try:
+        ok = conn.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+    except sqlite3.DatabaseError:
+        ok = False
+    conn.close()
+    if not ok:
+        os.remove(tmp_path)
+        raise sqlite3.DatabaseError(f"Snapshot {name} corrotto")
+
+    # Journal WAL/SHM del vecchio DB non devono essere applicati al file ripristinato
+    for ext in ("-wal", "-shm"):
+        if os.path.exists(DB_FILE + ext):
+            os.remove(DB_FILE + ext)
+    os.replace(tmp_path, DB_FILE)
+
+
+def _local_snapshot_time():
+    """Timestamp dell'ultimo snapshot preso dal DB locale (None se mai fatto o DB assente)."""
+    if not os.path.exists(DB_FILE):
+        return None
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            return get_sync_state(conn.cursor(), SNAPSHOT_KEY)
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return None
+
+
+def restore_latest_if_needed(storage=None):
+    """
+    Ripristino veloce all'avvio: se esiste uno snapshot più recente del DB locale
+    (o il DB manca), lo ripristina. Prova gli snapshot dal più recente finché uno è valido.
+    Ritorna il nome dello snapshot ripristinato o None.
+    """
+    storage = storage or get_storage()
+    local_time = _local_snapshot_time()
+    for name in reversed(storage.list()):
+        if local_time and _snapshot_time(name) <= local_time:
+            return None
+        try:
+            restore_snapshot(name, storage)
+            return name
+        except Exception as e:
+            logger.warning("⚠️ Ripristino di %s fallito: %s", name, e)
+    return None
+
+
+# Uso da riga di comando:
+#   python backup.py                -> crea uno snapshot
+#   python backup.py list           -> elenca gli snapshot
+#   python backup.py restore NOME   -> ripristina uno snapshot specifico (a bot spento)
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args:
+        print(f"✅ Snapshot creato: {take_snapshot()}")
+    elif args[0] == "list":
+        for snapshot in get_storage().list():
+            print(snapshot)
+    elif args[0] == "restore" and len(args) == 2:
+        restore_snapshot(args[1])
+        print(f"✅ Database ripristinato da {args[1]}")
+    else:
+        print("Uso: python backup.py [list | restore NOME]")
@@ -0,0 +1,171 @@
+import asyncio
+import functools
+import logging
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Finestra (secondi) in cui un comando pesante appena concluso riusa il suo risultato
+DEBOUNCE_SECONDS = 10
+# Intervallo minimo tra due aggiornamenti di avanzamento (evita il flood limit di Telegram)
+PROGRESS_INTERVAL = 2
+
+
+class HeavyJob:
+    """Un comando pesante in coda, con tutti gli utenti che lo hanno richiesto."""
+
+    def __init__(self, name, logic, parse_mode=None):
+        self.name = name
+        self.logic = logic
+        self.parse_mode = parse_mode
+        self.status_messages = []  # Un messaggio di stato per ogni richiedente
+        self.last_progress = 0.0
+        self.progress_futures = []  # Aggiornamenti di avanzamento inviati dal thread di lavoro
+        self.finished = False
+        self.result = None
+        self.result_parse_mode = None
+
+
+class HeavyJobQueue:
+    """
+    Coda seriale per i comandi pesanti (/scan, /importa).
+    Un solo lavoro alla volta gira in un thread separato, così il bot continua a
+    rispondere agli altri comandi. Richieste duplicate dello stesso comando vengono
+    unite in un'unica esecuzione il cui risultato arriva a tutti i richiedenti.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._worker = None
+        self._pending = {}  # nome comando -> HeavyJob in coda o in esecuzione
+        self._recent = {}   # nome comando -> (timestamp fine, risultato)
+        self._current = None  # HeavyJob in esecuzione (già tolto dalla coda)
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, update: Update, name, logic, parse_mode=None):
+        # 1. Risultato appena calcolato: lo consegniamo senza rieseguire
+        recent = self._recent.get(name)
+        if recent and time.monotonic() - recent[0] < DEBOUNCE_SECONDS:
+            await update.message.reply_text(recent[1], parse_mode=parse_mode)
+            return
+
+        # 2. Stesso comando già in coda/in esecuzione: ci accodiamo al suo risultato
+        job = self._pending.get(name)
+        if job:
+            msg = await update.message.reply_text(f"⏳ /{name} già in corso, riceverai lo stesso risultato.")
+            await self._attach(job, msg)
+            return
+
+        # 3. Nuovo lavoro: prima in coda, poi il messaggio di stato.
+        # Se la risposta fallisce (RetryAfter, rete) il lavoro gira comunque e non resta appeso in _pending
+        job = HeavyJob(name, logic, parse_mode)
+        position = self._queue.qsize() + 1 + (1 if self._current else 0)
+        self._pending[name] = job
+        self._queue.put_nowait(job)
+        msg = await update.message.reply_text(f"⏳ /{name} in coda (posizione {position})...")
+        await self._attach(job, msg)
+
+    async def _attach(self, job, msg):
+        """Registra il messaggio di stato di un richiedente, o gli consegna il risultato se il lavoro è già finito."""
+        if job.finished:
+            # Il lavoro si è concluso mentre inviavamo il messaggio: _notify non lo conosceva
+            try:
+                await msg.edit_text(job.result, parse_mode=job.result_parse_mode)
+            except Exception as e:
+                logger.debug("Consegna risultato /%s non riuscita: %s", job.name, e)
+        else:
+            job.status_messages.append(msg)
+
+    async def _notify(self, job, text, parse_mode=None):
+        for msg in list(job.status_messages):
+            try:
+                await msg.edit_text(text, parse_mode=parse_mode)
+            except Exception as e:
+                # Il testo potrebbe essere identico al precedente o il messaggio cancellato
+                logger.debug("Aggiornamento stato /%s non riuscito: %s", job.name, e)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            self._current = job
+            await self._notify(job, f"🔄 /{job.name} in esecuzione...")
+
+            def progress(text, job=job):
+                # Chiamata dal thread di lavoro: inoltriamo l'aggiornamento al loop del bot
+                now = time.monotonic()
+                if job.finished or now - job.last_progress < PROGRESS_INTERVAL:
+                    return
+                job.last_progress = now
+                future = asyncio.run_coroutine_threadsafe(self._notify(job, f"🔄 /{job.name}: {text}"), loop)
+                job.progress_futures.append(future)
+
+            try:
+                result = await asyncio.to_thread(job.logic, progress)
+                parse_mode = job.parse_mode
+                self._recent[job.name] = (time.monotonic(), result)
+                job.result, job.result_parse_mode = result, parse_mode
+            except Exception as e:
+                logger.exception("Errore durante /%s", job.name)
+                result = f"❌ Errore durante /{job.name}: {e}"
+                parse_mode = None
+                job.result, job.result_parse_mode = result, parse_mode
+            finally:
+                # Da qui in poi una nuova richiesta genera una nuova esecuzione (o usa _recent);
+                # chi si è unito durante l'invio del suo messaggio legge job.result (vedi _attach)
+                job.finished = True
+                self._current = None
+                self._pending.pop(job.name, None)
+                self._queue.task_done()
+
+            # Gli aggiornamenti di avanzamento ancora in volo devono arrivare PRIMA del risultato,
+            # altrimenti potrebbero sovrascriverlo
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in job.progress_futures), return_exceptions=True)
+            await self._notify(job, result, parse_mode)
+
+
+heavy_queue = HeavyJobQueue()
+
+
+def heavy_command(name, logic, parse_mode=None):
+    """Crea un handler Telegram che esegue `logic(progress)` tramite la coda seriale."""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await heavy_queue.submit(update, name, logic, parse_mode)
+    return handler
+
+
+def debounce_per_chat(func):
+    """
+    Unisce le invocazioni ripetute dello stesso comando nella stessa chat finché
+    la prima è in corso: la sua risposta arriva comunque in chat. Appena conclusa,
+    il comando si può rilanciare (es. dopo un errore API).
+    """
+    running = set()  # chat_id con il comando in esecuzione
+
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        if chat_id in running:
+            await update.message.reply_text("⏳ Comando già in corso, la risposta sta arrivando.")
+            return
+        running.add(chat_id)
+        try:
+            await func(update, context)
+        finally:
+            running.discard(chat_id)
+
+    return wrapper
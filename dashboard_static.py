@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import os
+import re
+from fastapi import Request
+from fastapi.responses import Response
+
+# Brotli è opzionale: senza il pacchetto serviamo solo gzip e non compresso
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEMPLATE_FILE = os.path.join("templates", "index.html")
+STATIC_PREFIX = "/static/"
+
+# Gli asset hanno l'hash nel nome: il contenuto di un URL non cambia mai
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# La pagina HTML va sempre riconvalidata (risposta 304 se l'ETag non è cambiato)
+HTML_CACHE_CONTROL = "no-cache"
+
+MEDIA_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+
+# Solo i blocchi inline: lo script esterno di Telegram (con src=) resta com'è
+STYLE_RE = re.compile(r"<style>(.*?)</style>", re.S)
+SCRIPT_RE = re.compile(r"<script>(.*?)</script>", re.S)
+
+
+class BuiltFile:
+    """Un file della dashboard con le sue varianti precompresse."""
+
+    def __init__(self, name, content):
+        self.name = name
+        self.media_type = MEDIA_TYPES[os.path.splitext(name)[1]]
+        self.variants = {"identity": content, "gzip": gzip.compress(content, 9, mtime=0)}
+        if brotli:
+            self.variants["br"] = brotli.compress(content, quality=11)
+        # ETag forte diverso per ogni codifica: varianti diverse non devono avere lo stesso ETag
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        suffixes = {"identity": "", "gzip": "-gz", "br": "-br"}
+        self.etags = {encoding: f'"{digest}{suffixes[encoding]}"' for encoding in self.variants}
+
+
+def _fingerprint(stem, ext, content):
+    return f"{stem}.{hashlib.sha256(content.encode()).hexdigest()[:12]}{ext}"
+
+
+def build_dashboard(template_file=TEMPLATE_FILE):
+    """
+    Estrae CSS e JS inline da index.html in asset con hash nel nome e
+    ritorna {nome: BuiltFile} con la pagina HTML sotto la chiave "index.html".
+    """
+    with open(template_file, encoding="utf-8") as f:
+        page = f.read()
+
+    files = {}
+
+    def extract(regex, ext, tag):
+        # Ogni blocco inline diventa un file e viene sostituito dal suo riferimento
+        def replace(match):
+            content = match.group(1).strip() + "\n"
+            name = _fingerprint("dashboard", ext, content)
+            files[name] = BuiltFile(name, content.encode("utf-8"))
+            return tag.format(STATIC_PREFIX + name)
+        return regex.sub(replace, page)
+
+    page = extract(STYLE_RE, ".css", '<link rel="stylesheet" href="{}">')
+    page = extract(SCRIPT_RE, ".js", '<script src="{}"></script>')
+
+    files["index.html"] = BuiltFile("index.html", page.encode("utf-8"))
+    return files
+
+
+def _accepted_encodings(request: Request):
+    """Codifiche accettate e rifiutate (q=0, es. "gzip;q=0") dal client."""
+    accepted, rejected = set(), set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            (accepted if q > 0 else rejected).add(coding.lower())
+    return accepted, rejected
+
+
+def _pick_encoding(built, request: Request):
+    accepted, rejected = _accepted_encodings(request)
+    for encoding in ("br", "gzip"):
+        if encoding in rejected or encoding not in built.variants:
+            continue
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return "identity"
+
+
+def serve_built(built, request: Request, cache_control):
+    """Risposta con la variante compressa migliore, ETag e 304 sulle richieste condizionali."""
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    encoding = _pick_encoding(built, request)
+
+    # Il client ha già in cache una delle varianti: 304 con l'ETag di quella variante
+    if_none_match = request.headers.get("if-none-match", "")
+    # Confronto debole (RFC 9110): un proxy che ricomprime può aver trasformato l'ETag in W/"..."
+    client_tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in client_tags:
+        client_tags.add(built.etags[encoding])
+    for etag in built.etags.values():
+        if etag in client_tags:
+            headers["ETag"] = etag
+            return Response(status_code=304, headers=headers)
+
+    headers["ETag"] = built.etags[encoding]
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=built.variants[encoding], media_type=built.media_type, headers=headers)
+
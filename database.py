@@ -19,6 +19,9 @@ def init_db():
     conn = get_connection()
     c = conn.cursor()
     
+    # WAL: le letture (e gli snapshot di backup) non bloccano le scritture di bot e dashboard
+    c.execute("PRAGMA journal_mode=WAL")
+    
     # Tabella GIOCATORI: Gestisce anagrafica, bollini status e note admin
     c.execute('''CREATE TABLE IF NOT EXISTS players
                  (tag TEXT PRIMARY KEY, 
@@ -36,10 +39,35 @@ def init_db():
                   decks_possible INTEGER,
                   fame INTEGER)''')
     
+    # Una sola riga per settimana/giocatore: rende idempotenti le importazioni (INSERT OR REPLACE)
+    # Prima rimuoviamo eventuali duplicati lasciati dalle versioni precedenti
+    c.execute('''DELETE FROM war_history WHERE id NOT IN
+                 (SELECT MAX(id) FROM war_history GROUP BY date, player_tag)''')
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_war_history_date_player
+                 ON war_history (date, player_tag)''')
+    
+    # Tabella SYNC_STATE: stato delle sincronizzazioni (high-water mark, cursori di ripresa)
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_state
+                 (key TEXT PRIMARY KEY, 
+                  value TEXT)''')
+    
     conn.commit()
     conn.close()
     print("✅ Database inizializzato correttamente (Supporto Fama attivo).")
 
+def get_sync_state(c, key):
+    """Legge un valore da sync_state (None se assente)."""
+    c.execute("SELECT value FROM sync_state WHERE key = ?", (key,))
+    row = c.fetchone()
+    return row[0] if row else None
+
+def set_sync_state(c, key, value):
+    """Scrive (o cancella, se value è None) un valore in sync_state. Il commit è a carico del chiamante."""
+    if value is None:
+        c.execute("DELETE FROM sync_state WHERE key = ?", (key,))
+    else:
+        c.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
 def make_api_request(endpoint):
     """
     Helper universale per le chiamate all'API di Clash Royale.
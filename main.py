@@ -1,8 +1,8 @@
+import asyncio
 import logging
 import sqlite3
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
-from fastapi.templating import Jinja2Templates
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -11,8 +11,11 @@ from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 from database import init_db, get_connection, TG_TOKEN
 
 # Import Comandi
-from war_attuale import scan_command, waroggi_command, war_command, set_status, set_note
-from war_passate import storia_command, import_history_command, sync_history_logic
+from war_attuale import scan_logic, waroggi_command, war_command, set_status, set_note
+from war_passate import storia_command, sync_history_logic, backfill_history_logic
+from coda_comandi import heavy_queue, heavy_command, debounce_per_chat
+from backup import get_storage, restore_latest_if_needed, backup_loop, take_snapshot
+from dashboard_static import build_dashboard, serve_built, ASSET_CACHE_CONTROL, HTML_CACHE_CONTROL
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 
@@ -25,23 +28,43 @@ class PlayerUpdate(BaseModel):
 # --- CICLO VITA ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Ripristino dall'ultimo snapshot PRIMA di qualsiasi reimportazione dall'API
+    backup_storage = get_storage()
+    try:
+        restored = restore_latest_if_needed(backup_storage)
+        if restored:
+            print(f"💾 Database ripristinato da {restored}")
+    except Exception as e:
+        print(f"⚠️ Warning ripristino backup: {e}")
     init_db()
+    # La dashboard non ha dati per richiesta: la costruiamo una volta sola
+    app.state.dashboard = build_dashboard()
     # Tenta il ripristino ma non blocca l'avvio se fallisce
     try:
         sync_history_logic()
     except Exception as e:
         print(f"⚠️ Warning ripristino dati: {e}")
 
-    bot_app = ApplicationBuilder().token(TG_TOKEN).build()
+    # Aggiornamenti gestiti in parallelo: un /scan lento non blocca il /war di un'altra chat
+    bot_app = ApplicationBuilder().token(TG_TOKEN).concurrent_updates(True).build()
     
     # Registra comandi
-    bot_app.add_handler(CommandHandler('scan', scan_command))
-    bot_app.add_handler(CommandHandler('waroggi', waroggi_command))
-    bot_app.add_handler(CommandHandler('war', war_command))
+    # I comandi pesanti passano dalla coda seriale (richieste duplicate unite in una sola esecuzione)
+    bot_app.add_handler(CommandHandler('scan', heavy_command('scan', scan_logic, parse_mode='Markdown')))
+    
+    async def importa_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /importa -> solo le settimane nuove, /importa completo -> tutto il riverracelog
+        if context.args and context.args[0].lower() == 'completo':
+            await heavy_queue.submit(update, 'importa completo', backfill_history_logic)
+        else:
+            await heavy_queue.submit(update, 'importa', sync_history_logic)
+    bot_app.add_handler(CommandHandler('importa', importa_command))
+    # I report leggeri ignorano i doppi invii nella stessa chat
+    bot_app.add_handler(CommandHandler('waroggi', debounce_per_chat(waroggi_command)))
+    bot_app.add_handler(CommandHandler('war', debounce_per_chat(war_command)))
     bot_app.add_handler(CommandHandler('status', set_status))
     bot_app.add_handler(CommandHandler('nota', set_note))
-    bot_app.add_handler(CommandHandler('storia', storia_command))
-    bot_app.add_handler(CommandHandler('importa', import_history_command))
+    bot_app.add_handler(CommandHandler('storia', debounce_per_chat(storia_command)))
     
     async def dashboard_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # NOTA: Sostituisci con il tuo URL Render reale
@@ -55,28 +78,43 @@ async def lifespan(app: FastAPI):
 
     await bot_app.initialize()
     await bot_app.start()
+    heavy_queue.start()
 
     # IMPOSTA I SUGGERIMENTI DEI COMANDI
     commands = [
         BotCommand("scan", "🔄 Aggiorna i dati della War corrente"),
         BotCommand("waroggi", "⚔️ Report attacchi di oggi"),
         BotCommand("war", "🏆 Andamento generale della settimana"),
-        BotCommand("storia", "📜 Storico ultime 10 settimane"),
+        BotCommand("storia", "📜 Storico delle settimane importate"),
         BotCommand("dashboard", "📱 Apri il gestionale web"),
         BotCommand("status", "🚦 Imposta status (0-3)"),
         BotCommand("nota", "📝 Aggiungi nota giocatore"),
-        BotCommand("importa", "📥 Riscarica lo storico dall'API")
+        BotCommand("importa", "📥 Importa le nuove settimane (completo = tutto lo storico)")
     ]
     await bot_app.bot.set_my_commands(commands)
 
     await bot_app.updater.start_polling()
+    backup_task = asyncio.create_task(backup_loop(backup_storage))
     yield
     await bot_app.updater.stop()
+    await heavy_queue.stop()
     await bot_app.stop()
     await bot_app.shutdown()
 
+    # Snapshot finale: su un host effimero è l'ultima occasione di salvare status e note
+    # Fermiamo il task periodico; uno snapshot già avviato nel suo thread viene
+    # comunque serializzato con quello finale dal lock in take_snapshot
+    backup_task.cancel()
+    try:
+        await backup_task
+    except asyncio.CancelledError:
+        pass
+    try:
+        await asyncio.to_thread(take_snapshot, backup_storage)
+    except Exception as e:
+        print(f"⚠️ Warning backup finale: {e}")
+
 app = FastAPI(lifespan=lifespan)
-templates = Jinja2Templates(directory="templates")
 
 # Abilita CORS per sicurezza
 app.add_middleware(
@@ -90,7 +128,14 @@ app.add_middleware(
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return serve_built(app.state.dashboard["index.html"], request, HTML_CACHE_CONTROL)
+
+@app.get("/static/{filename}")
+async def read_static(filename: str, request: Request):
+    built = app.state.dashboard.get(filename)
+    if not built or filename == "index.html":
+        raise HTTPException(status_code=404)
+    return serve_built(built, request, ASSET_CACHE_CONTROL)
 
 @app.get("/api/data")
 async def get_dashboard_data():
@@ -105,7 +150,7 @@ async def get_dashboard_data():
     # Quindi dobbiamo scaricare la lista membri dal API e filtrare.
     
     from database import make_api_request
-    clan_data = make_api_request("")
+    clan_data = await asyncio.to_thread(make_api_request, "")
     active_tags = set()
     if clan_data and 'memberList' in clan_data:
         for m in clan_data['memberList']:
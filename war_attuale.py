@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import html
 from telegram import Update
@@ -5,17 +6,15 @@ from telegram.ext import ContextTypes
 from database import get_connection, make_api_request, CLAN_TAG
 
 # --- LOGICA DI SCAN (Aggiorna DB per storico) ---
-async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🔄 **Analisi e Salvataggio Dati War...**")
-    
+def scan_logic(progress=None):
+    """Scarica la war corrente e aggiorna il DB. Ritorna il messaggio di esito (Markdown)."""
     # 1. Recupero dati War Corrente
     war_data = make_api_request("currentriverrace")
     # 2. Recupero tutti i membri (anche quelli che non hanno fatto war)
     members_data = make_api_request("") 
     
     if not war_data or not members_data:
-        await update.message.reply_text("❌ Errore API: Impossibile scaricare i dati.")
-        return
+        return "❌ Errore API: Impossibile scaricare i dati."
 
     all_members = members_data.get('memberList', [])
 
@@ -55,9 +54,11 @@ async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     count_updated = 0
     count_new = 0
     
-    for m in all_members:
+    for i, m in enumerate(all_members, 1):
         tag = m['tag']
         name = m['name']
+        if progress:
+            progress(f"salvataggio giocatore {i}/{len(all_members)}")
         
         # Aggiorniamo anagrafica giocatori (Status e Note rimangono invariati se esistono)
         c.execute("INSERT OR IGNORE INTO players (tag, name, status, admin_notes) VALUES (?, ?, 0, '')", (tag, name))
@@ -94,12 +95,12 @@ async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     conn.commit()
     conn.close()
     
-    await update.message.reply_text(f"✅ **Database Aggiornato!**\nSettimana: `{week_id}`\nNuovi record: {count_new}\nAggiornati: {count_updated}", parse_mode='Markdown')
+    return f"✅ **Database Aggiornato!**\nSettimana: `{week_id}`\nNuovi record: {count_new}\nAggiornati: {count_updated}"
 
 
 # --- COMANDO /WAROGGI (Attacchi del Giorno) ---
 async def waroggi_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    war_data = make_api_request("currentriverrace")
+    war_data = await asyncio.to_thread(make_api_request, "currentriverrace")
     if not war_data:
         await update.message.reply_text("❌ Errore API.")
         return
@@ -145,7 +146,7 @@ async def waroggi_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     report_list = []
     
     # Fetch membri attuali
-    clan_info = make_api_request("")
+    clan_info = await asyncio.to_thread(make_api_request, "")
     all_current_members = clan_info.get('memberList', []) if clan_info else []
     
     for m in all_current_members:
@@ -200,7 +201,7 @@ async def waroggi_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- COMANDO /WAR (Andamento Globale Settimana) ---
 async def war_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    war_data = make_api_request("currentriverrace")
+    war_data = await asyncio.to_thread(make_api_request, "currentriverrace")
     if not war_data:
         await update.message.reply_text("❌ Errore API.")
         return
@@ -237,7 +238,7 @@ async def war_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     participants = {p['tag']: p for p in clan.get('participants', [])}
     
     # Fetch membri attuali
-    clan_info = make_api_request("")
+    clan_info = await asyncio.to_thread(make_api_request, "")
     all_current_members = clan_info.get('memberList', []) if clan_info else []
     
     report_list = []
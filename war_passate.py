@@ -1,83 +1,137 @@
+import asyncio
 import sqlite3
 import html
+import urllib.parse
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import get_connection, make_api_request, CLAN_TAG
+from database import get_connection, make_api_request, get_sync_state, set_sync_state, CLAN_TAG
 
 import datetime
 
-# --- LOGICA PURA (Funziona senza utente) ---
-def sync_history_logic():
-    """Scarica lo storico e popola il DB. Ritorna un messaggio di stato."""
-    log_data = make_api_request("riverracelog?limit=10")
-    if not log_data or 'items' not in log_data:
-        return "❌ Errore API: Impossibile scaricare lo storico."
+# Numero di settimane richieste per ogni pagina del riverracelog
+HISTORY_PAGE_SIZE = 10
+
+# Chiavi in sync_state
+HWM_KEY = "riverracelog_hwm"                 # createdDate della war più recente importata
+CURSOR_KEY = "riverracelog_cursor"           # cursore 'after' da cui riprendere una sync interrotta
+TARGET_KEY = "riverracelog_target"           # high-water mark a cui si fermava la sync interrotta
+PENDING_HWM_KEY = "riverracelog_pending_hwm" # war più recente vista dalla sync in corso
 
+# --- LOGICA PURA (Funziona senza utente) ---
+def sync_history_logic(progress=None, full=False):
+    """
+    Scarica lo storico e popola il DB. Ritorna un messaggio di stato.
+    Di default importa solo le war più recenti dell'high-water mark, pagina per pagina;
+    se una sync precedente si è interrotta riprende dal cursore salvato.
+    Con full=True ripercorre tutto il riverracelog disponibile.
+    """
     conn = get_connection()
     c = conn.cursor()
-    imported_weeks = 0
-    
+
+    hwm = get_sync_state(c, HWM_KEY)
+    cursor = get_sync_state(c, CURSOR_KEY)
+    if full or cursor is None:
+        # Nuova sync dall'inizio del log (le war più recenti vengono per prime)
+        cursor = None
+        target = None if full else hwm
+        pending_hwm = None
+    else:
+        # Ripresa di una sync interrotta: stesso obiettivo, stesse war già viste
+        target = get_sync_state(c, TARGET_KEY)
+        pending_hwm = get_sync_state(c, PENDING_HWM_KEY)
+
     # Calcolo Lunedì della settimana CORRENTE per escluderla dallo storico
     today = datetime.date.today()
     current_monday = today - datetime.timedelta(days=today.weekday())
     current_week_date = current_monday.strftime('%Y%m%d')
-    
-    for race in log_data['items']:
-        season_id = race.get('sectionIndex', 'S')
-        # L'API restituisce createdDate come "20231023T100000.000Z"
-        raw_date_full = race.get('createdDate', '00000000')
-        raw_date = raw_date_full[:8]
-        
-        # FIX: Se la data del log corrisponde alla settimana corrente, SALTA.
-        # Questo evita duplicati tra /war (Week-...) e /storia (W-...)
-        if raw_date == current_week_date:
-            continue
 
-        week_label = f"W{season_id}-{raw_date}"
-        
-        my_clan = None
-        for standing in race.get('standings', []):
-            if standing['clan']['tag'] == f"#{CLAN_TAG}":
-                my_clan = standing['clan']
+    imported_weeks = 0
+    pages = 0
+    while True:
+        endpoint = f"riverracelog?limit={HISTORY_PAGE_SIZE}"
+        if cursor:
+            endpoint += f"&after={urllib.parse.quote(cursor)}"
+        log_data = make_api_request(endpoint)
+        if not log_data or 'items' not in log_data:
+            conn.close()
+            # Il cursore salvato resta: la prossima sync riprenderà da qui
+            return f"❌ Errore API: storico interrotto dopo {imported_weeks} settimane, verrà ripreso alla prossima sync."
+        pages += 1
+
+        players_rows = []
+        history_rows = []
+        reached_target = False
+        for race in log_data['items']:
+            season_id = race.get('sectionIndex', 'S')
+            # L'API restituisce createdDate come "20231023T100000.000Z"
+            raw_date_full = race.get('createdDate', '00000000')
+            raw_date = raw_date_full[:8]
+
+            # Le war sono in ordine dalla più recente: arrivati all'high-water mark abbiamo finito
+            if target and raw_date_full <= target:
+                reached_target = True
                 break
-        
-        if not my_clan: continue
-        imported_weeks += 1
-        
-        for p in my_clan.get('participants', []):
-            tag, name = p['tag'], p['name']
-            used, fame = p['decksUsed'], p['fame']
-            
-            c.execute("INSERT OR IGNORE INTO players (tag, name, status, admin_notes) VALUES (?, ?, 0, '')", (tag, name))
-            c.execute("""INSERT OR REPLACE INTO war_history 
+
+            # FIX: Se la data del log corrisponde alla settimana corrente, SALTA.
+            # Questo evita duplicati tra /war (Week-...) e /storia (W-...)
+            if raw_date == current_week_date:
+                continue
+
+            week_label = f"W{season_id}-{raw_date}"
+
+            my_clan = None
+            for standing in race.get('standings', []):
+                if standing['clan']['tag'] == f"#{CLAN_TAG}":
+                    my_clan = standing['clan']
+                    break
+
+            if not my_clan: continue
+            imported_weeks += 1
+            if pending_hwm is None or raw_date_full > pending_hwm:
+                pending_hwm = raw_date_full
+
+            for p in my_clan.get('participants', []):
+                players_rows.append((p['tag'], p['name']))
+                history_rows.append((week_label, p['tag'], p['decksUsed'], 16, p['fame']))
+
+        cursor = log_data.get('paging', {}).get('cursors', {}).get('after')
+        done = reached_target or not cursor
+
+        c.executemany("INSERT OR IGNORE INTO players (tag, name, status, admin_notes) VALUES (?, ?, 0, '')", players_rows)
+        c.executemany("""INSERT OR REPLACE INTO war_history 
                          (date, player_tag, decks_used, decks_possible, fame) 
-                         VALUES (?, ?, ?, ?, ?)""", (week_label, tag, used, 16, fame))
+                         VALUES (?, ?, ?, ?, ?)""", history_rows)
+        if done:
+            # Sync completata: avanziamo l'high-water mark e cancelliamo lo stato di ripresa
+            if pending_hwm and (hwm is None or pending_hwm > hwm):
+                set_sync_state(c, HWM_KEY, pending_hwm)
+            set_sync_state(c, CURSOR_KEY, None)
+            set_sync_state(c, TARGET_KEY, None)
+            set_sync_state(c, PENDING_HWM_KEY, None)
+        else:
+            # Salviamo il punto di ripresa nella stessa transazione dei dati della pagina
+            set_sync_state(c, CURSOR_KEY, cursor)
+            set_sync_state(c, TARGET_KEY, target)
+            set_sync_state(c, PENDING_HWM_KEY, pending_hwm)
+        conn.commit()
 
-    conn.commit()
-    conn.close()
-    return f"✅ Storico ripristinato: {imported_weeks} settimane caricate (filtrando la corrente)."
+        if progress:
+            progress(f"pagina {pages}, {imported_weeks} settimane importate")
+        if done:
+            break
 
-# --- COMANDI TELEGRAM ---
-async def import_history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("⏳ Svuoto e ricarico lo storico...")
-    # Eseguiamo un reset pulito per evitare duplicati
-    conn = get_connection()
-    c = conn.cursor()
-    # Pulisci SOLO lo storico vero (W...)
-    c.execute("DELETE FROM war_history WHERE date LIKE 'W%' AND date NOT LIKE 'Week-%'")
-    # Per sicurezza, cancelliamo anche eventuali vecchie chiavi 'Week-...' se non è la corrente? 
-    # No, lasciamo che /scan gestisca Week-.
-    # Ma cancelliamo la corrente se l'abbiamo importata per sbaglio come W...
-    
-    conn.commit()
     conn.close()
-    
-    # Chiama la logica pura
-    result = sync_history_logic()
-    await update.message.reply_text(result)
+    if imported_weeks == 0:
+        return "✅ Storico già aggiornato: nessuna nuova settimana."
+    return f"✅ Storico aggiornato: {imported_weeks} settimane caricate (filtrando la corrente)."
 
+def backfill_history_logic(progress=None):
+    """Ripercorre l'intero riverracelog (tutte le pagine disponibili)."""
+    return sync_history_logic(progress, full=True)
+
+# --- COMANDI TELEGRAM ---
 async def storia_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    clan_data = make_api_request("") # Chiede la lista membri attuale
+    clan_data = await asyncio.to_thread(make_api_request, "") # Chiede la lista membri attuale
     if not clan_data:
         await update.message.reply_text("❌ Errore API: impossibile recuperare i membri attuali.")
         return
@@ -99,13 +153,15 @@ async def storia_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     c.execute(query)
     rows = c.fetchall()
+    c.execute("SELECT COUNT(DISTINCT date) FROM war_history WHERE date LIKE 'W%' AND date NOT LIKE 'Week-%'")
+    total_weeks = c.fetchone()[0]
     conn.close()
 
     if not rows:
         await update.message.reply_text("⚠️ Database vuoto. Attendi il ripristino automatico o usa /importa.")
         return
 
-    msg = "📊 <b>STORICO ULTIME 10 SETTIMANE</b>\n"
+    msg = f"📊 <b>STORICO ULTIME {total_weeks} SETTIMANE</b>\n"
     msg += "<code>St| Nome      | Att    | Punti </code>\n"
     msg += "<code>--|-----------|--------|-------</code>\n"
 